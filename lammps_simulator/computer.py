@@ -1,33 +1,223 @@
-import re
+import os
+import time
+import tempfile
 import subprocess
-from numpy import ndarray
+from itertools import chain
+from functools import lru_cache
+from .device import _is_index_variable, _index_strings
+
+_RUNNING = {}    # process-ID -> Popen of local simulations that are not waited for
+
+
+def _forget_finished():
+    """Reap local simulations that have finished and stop keeping them,
+    such that runs that are never waited for do not pile up
+    """
+    for pid, procs in list(_RUNNING.items()):
+        if procs.poll() is not None:
+            _RUNNING.pop(pid, None)
+
+
+@lru_cache(maxsize=64)
+def _exec_prefix(num_procs, lmp_exec, lmp_args):
+    """Making the part of the mpirun arguments that does not depend on the
+    LAMMPS variables, which is shared by all simulations of a sweep:
+
+        tuple = ('mpirun', '-n', {num_procs}, {lmp_exec}, {lmp_args})
+
+    :param num_procs: number of processes
+    :type num_procs: int
+    :param lmp_exec: LAMMPS executable
+    :type lmp_exec: str
+    :param lmp_args: LAMMPS command line arguments as (key, value) pairs
+    :type lmp_args: tuple
+    :returns: tuple with mpirun executables
+    :rtype: tuple of str
+    """
+    return tuple(chain(("mpirun", "-n", str(num_procs), lmp_exec),
+                       *((key, *str(value).split()) for key, value in lmp_args)))
 
 
 class Computer:
     """Computer base class, which controls how to run LAMMPS.
-    The required methods are __init__ and __call__.
+    The required method is __init__, which has to set the attributes
+    below, as well as slurm, and the number of processes used by _np.
 
     :param lmp_exec: LAMMPS executable
     :type lmp_exec: str
     :param lmp_args: LAMMPS command line arguments
     :type lmp_args: dict
     """
+    _poll_cache = {}
+    _queue = ()     # queued simulations, a list on computers running Slurm
+
     def __init__(self, lmp_exec="lmp", lmp_args={}):
         raise NotImplementedError("Class {} has no instance '__init__'."
                                   .format(self.__class__.__name__))
 
-    def __call__(self, lmp_script, lmp_var):
-        """Start LAMMPS simulation
+    @property
+    def _np(self):
+        """Number of processes passed to mpirun"""
+        return self.num_procs
+
+    def __call__(self, lmp_script, lmp_var, stdout, stderr, cwd=None):
+        """Start LAMMPS simulation, either directly or by submitting it
+        to Slurm
 
         :param lmp_script: LAMMPS script
         :type lmp_script: str
         :param lmp_var: LAMMPS lmp_variables defined by the command line
         :type lmp_var: dict
+        :param stdout: where to write output from LAMMPS simulation
+        :type stdout: subprocess output object
+        :param stderr: where to write errors from LAMMPS simulation
+        :type stderr: subprocess output object
+        :param cwd: directory to run the simulation from, the current working directory by default
+        :type cwd: str
         :returns: job-ID
         :rtype: int
         """
-        raise NotImplementedError("Class {} has no instance '__call__'."
-                                  .format(self.__class__.__name__))
+        lmp_args = {**self.lmp_args, "-in": lmp_script}
+        exec_list = self.get_exec_list(self._np, self.lmp_exec, lmp_args, lmp_var)
+        if self.slurm:
+            job_id = self._submit(exec_list, stderr, cwd)
+            if getattr(self, "block", False):
+                print(f"Simulation with job ID {job_id} finished")
+                return job_id
+        else:
+            procs = subprocess.Popen(exec_list, stdin=subprocess.DEVNULL, stdout=stdout, stderr=stderr,
+                                     cwd=cwd, start_new_session=True, close_fds=True)
+            job_id = procs.pid
+            _forget_finished()
+            # pipes nobody reads would keep their file descriptors open
+            if getattr(self, "keep_pipes", False) or subprocess.PIPE not in (stdout, stderr):
+                _RUNNING[job_id] = procs
+        print(f"Simulation started with job ID {job_id}")
+        return job_id
+
+    def queue(self, lmp_script, lmp_var):
+        """Queue LAMMPS simulation, to be submitted together with all other
+        queued simulations as a single Slurm array job by flush
+
+        :param lmp_script: LAMMPS script
+        :type lmp_script: str
+        :param lmp_var: LAMMPS lmp_variables defined by the command line
+        :type lmp_var: dict
+        :returns: array task ID of the simulation
+        :rtype: int
+        """
+        if not self.slurm:
+            raise ValueError(f"Simulations can only be queued on Slurm computers, not on {self}")
+        lmp_args = {**self.lmp_args, "-in": lmp_script}
+        self._queue.append(self.get_exec_list(self._np, self.lmp_exec, lmp_args, lmp_var))
+        return len(self._queue) - 1
+
+    def flush(self, stderr=None, cwd=None):
+        """Submit all queued simulations as one Slurm array job. The
+        jobscript dispatches on $SLURM_ARRAY_TASK_ID, such that sbatch is
+        only called once:
+
+            case $SLURM_ARRAY_TASK_ID in
+            0) mpirun -n {num_procs} {lmp_exec} -in {lmp_script_0} ... ;;
+            1) mpirun -n {num_procs} {lmp_exec} -in {lmp_script_1} ... ;;
+            ...
+            esac
+
+        :param stderr: where to write errors from sbatch
+        :type stderr: subprocess output object
+        :param cwd: directory to submit the job from, the current working directory by default
+        :type cwd: str
+        :returns: job-IDs of the array tasks, on the form {job-ID}_{task-ID}
+        :rtype: list of str
+        """
+        if not self._queue:
+            return []
+        tasks = "".join(f"{i}) {' '.join(exec_list)} ;;\n" for i, exec_list in enumerate(self._queue))
+        dispatch = f"case $SLURM_ARRAY_TASK_ID in\n{tasks}esac\n"
+        slurm_args = {**self.slurm_args, "array": f"0-{len(self._queue) - 1}"}
+        script = self._build_script_text([dispatch], slurm_args)
+        self._store_jobscript(script, cwd)
+        output = subprocess.check_output(["sbatch", "--parsable"], input=script.encode(), stderr=stderr, cwd=cwd)
+        job_id = int(output.split(b";")[0])
+        print(f"Array job with {len(self._queue)} simulations started with job ID {job_id}")
+        job_ids = [f"{job_id}_{i}" for i in range(len(self._queue))]
+        self._queue = []
+        return job_ids
+
+    @staticmethod
+    def wait(pid):
+        """Wait for local simulation to finish. Piped output is read and
+        discarded while waiting, as a full pipe would block the simulation.
+        Simulations with piped output are only kept with keep_pipes=True,
+        and simulations that finished before another one was started are
+        no longer kept
+
+        :param pid: process-ID returned when the simulation was started
+        :type pid: int
+        :returns: return code of simulation
+        :rtype: int
+        """
+        try:
+            procs = _RUNNING.pop(pid)
+        except KeyError:
+            raise ValueError(f"Simulation {pid} is not running or was not kept") from None
+        procs.communicate()
+        return procs.returncode
+
+    @classmethod
+    def wait_all(cls):
+        """Wait for all local simulations to finish
+
+        :returns: return code of each simulation by process-ID
+        :rtype: dict
+        """
+        return {pid: cls.wait(pid) for pid in list(_RUNNING)}
+
+    @classmethod
+    def poll_jobs(cls, job_ids, min_poll_interval=10):
+        """Get state of several Slurm jobs with a single squeue call. Jobs
+        that are no longer listed by squeue are reported as 'COMPLETED'.
+        Array tasks can be polled as {job-ID}_{task-ID}, while an array job
+        polled by its job-ID gets the state of one of its listed tasks.
+        Results are reused for min_poll_interval seconds, to avoid
+        hitting the Slurm controller too often. If squeue fails, the
+        previous result is returned if any, otherwise an error is raised
+
+        :param job_ids: job-IDs to poll
+        :type job_ids: list of int or str
+        :param min_poll_interval: seconds to reuse previous result, 10 by default
+        :type min_poll_interval: float
+        :returns: state of each job, like 'PENDING', 'RUNNING' or 'COMPLETED'
+        :rtype: dict
+        """
+        key = tuple(map(str, job_ids))
+        now = time.monotonic()
+        if key in cls._poll_cache:
+            poll_time, states = cls._poll_cache[key]
+            if now - poll_time < min_poll_interval:
+                return dict(states)
+        # -r lists pending array tasks one per line instead of as {job-ID}_[0-3]
+        command = ["squeue", "-h", "-r", "-j", ",".join(key), "-o", "%i %T"]
+        res = subprocess.run(command, capture_output=True, text=True)
+        if res.returncode != 0:
+            # empty output does not mean the jobs are completed
+            if key in cls._poll_cache:
+                return dict(cls._poll_cache[key][1])
+            raise subprocess.CalledProcessError(res.returncode, command, res.stdout, res.stderr)
+        listed = {}
+        for line in res.stdout.splitlines():
+            if line.strip():
+                job_id, state = line.split()
+                listed[job_id] = state
+                listed.setdefault(job_id.split("_")[0], state)
+        states = {job_id: listed.get(job_id, "COMPLETED") for job_id in key}
+        # results that would not be reused are dropped, such that the cache
+        # does not grow when many different jobs are polled
+        for old_key, (poll_time, _) in list(cls._poll_cache.items()):
+            if now - poll_time >= min_poll_interval:
+                del cls._poll_cache[old_key]
+        cls._poll_cache[key] = (now, states)
+        return dict(states)
 
     @staticmethod
     def get_exec_list(num_procs, lmp_exec, lmp_args, lmp_var):
@@ -47,18 +237,19 @@ class Computer:
         :returns: list with mpirun executables
         :rtype: list of str
         """
-        exec_list = ["mpirun", "-n", str(num_procs), lmp_exec]
-        for key, value in lmp_args.items():
-            exec_list.append(key)
-            exec_list.extend(str(value).split())
+        lmp_args = tuple(lmp_args.items())
+        try:
+            parts = [_exec_prefix(num_procs, lmp_exec, lmp_args)]
+        except TypeError:   # unhashable argument, cannot be cached
+            parts = [_exec_prefix.__wrapped__(num_procs, lmp_exec, lmp_args)]
         for key, value in lmp_var.items():
+            assert(str(key).isidentifier()), f"Invalid LAMMPS variable name '{key}'"
             # variable may be an LAMMPS index variable
-            if type(value) in [list, tuple, ndarray]:
-                exec_list.extend(["-var", key])
-                exec_list.extend(map(str, list(value)))
+            if _is_index_variable(value):
+                parts.append(("-var", str(key), *_index_strings(value)))
             else:
-                exec_list.extend(["-var", key, str(value)])
-        return exec_list
+                parts.append(("-var", str(key), str(value)))
+        return list(chain.from_iterable(parts))
 
     @staticmethod
     def gen_jobscript(exec_list, jobscript, slurm_args):
@@ -78,14 +269,79 @@ class Computer:
         :type slurm_args: dict
         """
         with open(jobscript, "w") as f:
-            f.write("#!/bin/bash\n\n")
-            for key, setting in slurm_args.items():
-                if setting is None:
-                    f.write(f"#SBATCH --{key}\n#\n")
-                else:
-                    f.write(f"#SBATCH --{key}={setting}\n#\n")
-            f.write("\n")
-            f.write(" ".join(exec_list))
+            f.write(Computer._build_script_text(exec_list, slurm_args))
+
+    @staticmethod
+    def _build_script_text(exec_list, slurm_args):
+        """Render jobscript, see gen_jobscript
+
+        :param exec_list: list of strings to be executed
+        :type exec_list: list
+        :param slurm_args: slurm sbatch command line arguments to be used
+        :type slurm_args: dict
+        :returns: content of jobscript
+        :rtype: str
+        """
+        lines = ["#!/bin/bash\n\n"]
+        lines += [f"#SBATCH --{key}\n#\n" if setting is None else f"#SBATCH --{key}={setting}\n#\n"
+                  for key, setting in slurm_args.items()]
+        lines.append("\n")
+        lines.append(" ".join(exec_list))
+        return "".join(lines)
+
+    def _store_jobscript(self, script, cwd=None):
+        """Store jobscript for inspection. If no jobscript filename is
+        given, the jobscript is stored in a temporary file on tmpfs
+        ($XDG_RUNTIME_DIR or /dev/shm), which is created once and rewritten
+        on every submission
+
+        :param script: content of jobscript
+        :type script: str
+        :param cwd: directory to store the jobscript in, the current working directory by default
+        :type cwd: str
+        :returns: path of stored jobscript
+        :rtype: str
+        """
+        if self.jobscript is not None:
+            path = os.path.join(cwd or "", self.jobscript)
+        else:
+            path = getattr(self, "_tmp_jobscript", None)
+            if path is None:
+                tmpdir = os.environ.get("XDG_RUNTIME_DIR", "/dev/shm")
+                with tempfile.NamedTemporaryFile(dir=tmpdir if os.path.isdir(tmpdir) else None,
+                                                 prefix="lammps_", suffix=".sh", delete=False) as f:
+                    path = self._tmp_jobscript = f.name
+        with open(path, "w") as f:
+            f.write(script)
+        return path
+
+    def _submit(self, exec_list, stderr=None, cwd=None):
+        """Submit simulation to Slurm. A generated jobscript is piped to
+        the standard input of sbatch, such that sbatch does not have to
+        read it back from the file system. The jobscript file is still
+        stored for inspection. If the jobscript is not generated, the
+        existing jobscript file is submitted
+
+        :param exec_list: list of strings to be executed
+        :type exec_list: list
+        :param stderr: where to write errors from sbatch
+        :type stderr: subprocess output object
+        :param cwd: directory to submit the job from, the current working directory by default
+        :type cwd: str
+        :returns: job-ID
+        :rtype: int
+        """
+        command = ["sbatch", "--parsable"]
+        if getattr(self, "block", False):
+            command.append("--wait")
+        if self.generate_jobscript:
+            script = self._build_script_text(exec_list, self.slurm_args)
+            self._store_jobscript(script, cwd)
+            output = subprocess.check_output(command, input=script.encode(), stderr=stderr, cwd=cwd)
+        else:
+            output = subprocess.check_output(command + [self.jobscript], stderr=stderr, cwd=cwd)
+        # --parsable prints {job-ID} or {job-ID};{cluster}
+        return int(output.split(b";")[0])
 
 
 class Custom(Computer):
@@ -105,20 +361,25 @@ class Custom(Computer):
     :type slurm_args: dict
     :param generate_jobscript: whether or not jobscript should be generated, 'True' by default
     :type generate_jobscript: bool
-    :param jobscript: filename of jobscript, 'job.sh' by default
+    :param jobscript: filename of jobscript, 'job.sh' by default. If None, the generated jobscript is kept in a temporary file on tmpfs
     :type jobscript: str
+    :param keep_pipes: whether or not to keep local simulations with piped output, such that they can be waited for, 'False' by default
+    :type keep_pipes: bool
     """
     def __init__(self, num_procs=1, lmp_exec="lmp", lmp_args={},
                  slurm=False, slurm_args={}, generate_jobscript=True,
-                 jobscript="job.sh"):
+                 jobscript="job.sh", keep_pipes=False):
         self.num_procs = num_procs
         self.lmp_exec = lmp_exec
         self.lmp_args = lmp_args
         self.slurm = slurm
         self.slurm_args = slurm_args
+        if jobscript is None and not generate_jobscript:
+            raise ValueError("A jobscript filename is needed when the jobscript is not generated")
         self.generate_jobscript = generate_jobscript
         self.jobscript = jobscript
-        
+        self.keep_pipes = keep_pipes
+        self._queue = []
 
     def __str__(self):
         repr = "Custom"
@@ -126,21 +387,6 @@ class Custom(Computer):
             repr += " (slurm)"
         return repr
 
-    def __call__(self, lmp_script, lmp_var, stdout, stderr):
-        self.lmp_args["-in"] = lmp_script
-
-        exec_list = self.get_exec_list(self.num_procs, self.lmp_exec, self.lmp_args, lmp_var)
-        if self.slurm:
-            if self.generate_jobscript:
-                self.gen_jobscript(exec_list, self.jobscript, self.slurm_args)
-            output = str(subprocess.check_output(["sbatch", self.jobscript]))
-            job_id = int(re.findall("([0-9]+)", output)[0])
-        else:
-            procs = subprocess.Popen(exec_list, stdout=stdout, stderr=stderr)
-            job_id = procs.pid
-        print(f"Simulation started with job ID {job_id}")
-        return job_id
-
 
 class CPU(Computer):
     """Run simulations on desk computer. This method runs the executable
@@ -155,25 +401,19 @@ class CPU(Computer):
     :type lmp_exec: str
     :param lmp_args: LAMMPS command line arguments
     :type lmp_args: dict
+    :param keep_pipes: whether or not to keep simulations with piped output, such that they can be waited for, 'False' by default
+    :type keep_pipes: bool
     """
-    def __init__(self, num_procs=4, lmp_exec="lmp", lmp_args={}):
+    def __init__(self, num_procs=4, lmp_exec="lmp", lmp_args={}, keep_pipes=False):
         self.num_procs = num_procs
         self.lmp_exec = lmp_exec
         self.lmp_args = lmp_args
+        self.keep_pipes = keep_pipes
         self.slurm = False
 
     def __str__(self):
         return "CPU"
 
-    def __call__(self, lmp_script, lmp_var, stdout, stderr):
-        self.lmp_args["-in"] = lmp_script
-
-        exec_list = self.get_exec_list(self.num_procs, self.lmp_exec, self.lmp_args, lmp_var)
-        procs = subprocess.Popen(exec_list, stdout=stdout, stderr=stderr)
-        job_id = procs.pid
-        print(f"Simulation started with job ID {job_id}")
-        return job_id
-
 
 class GPU(Computer):
     """Run simulations on gpu.
@@ -188,36 +428,37 @@ class GPU(Computer):
     :type lmp_args: dict
     :param mode: GPU mode, has to be either 'kokkos' or 'gpu', 'kokkos' by default
     :type mode: str
+    :param keep_pipes: whether or not to keep simulations with piped output, such that they can be waited for, 'False' by default
+    :type keep_pipes: bool
     """
+    _LMP_TEMPLATES = {
+        "kokkos": (("-pk", "kokkos newton on neigh full"),
+                   ("-k", "on g {gpu_per_node}"),
+                   ("-sf", "kk")),
+        "gpu": (("-pk", "gpu newton on neigh full"),
+                ("-sf", "gpu")),
+    }
+
     def __init__(self, gpu_per_node=1, lmp_exec="lmp", lmp_args={},
-                 mode="kokkos"):
+                 mode="kokkos", keep_pipes=False):
         self.gpu_per_node = gpu_per_node
         self.lmp_exec = lmp_exec
+        self.keep_pipes = keep_pipes
         self.slurm = False
 
-        if mode == "kokkos":
-            default_lmp_args = {"-pk": "kokkos newton on neigh full",
-                                "-k": f"on g {self.gpu_per_node}",
-                                "-sf": "kk"}
-        elif mode == "gpu":
-            default_lmp_args = {"-pk": "gpu newton on neigh full",
-                                "-sf": "gpu"}
-        else:
+        if mode not in self._LMP_TEMPLATES:
             raise NotImplementedError
+        default_lmp_args = {key: setting.format(gpu_per_node=self.gpu_per_node)
+                            for key, setting in self._LMP_TEMPLATES[mode]}
 
         self.lmp_args = {**default_lmp_args, **lmp_args}    # merge
 
     def __str__(self):
         return "GPU"
 
-    def __call__(self, lmp_script, lmp_var, stdout, stderr):
-        self.lmp_args["-in"] = lmp_script
-
-        exec_list = self.get_exec_list(self.gpu_per_node, self.lmp_exec, self.lmp_args, lmp_var)
-        procs = subprocess.Popen(exec_list, stdout=stdout, stderr=stderr)
-        job_id = procs.pid
-        print(f"Simulation started with job ID {job_id}")
-        return job_id
+    @property
+    def _np(self):
+        return self.gpu_per_node
 
 
 class SlurmCPU(Computer):
@@ -243,43 +484,39 @@ class SlurmCPU(Computer):
     :type procs_per_node: int
     :param generate_jobscript: whether or not jobscript should be generated, 'True' by default
     :type generate_jobscript: bool
-    :param jobscript: filename of jobscript, 'job.sh' by default
+    :param jobscript: filename of jobscript, 'job.sh' by default. If None, the generated jobscript is kept in a temporary file on tmpfs
     :type jobscript: str
+    :param block: whether or not to wait for the job to finish, using 'sbatch --wait', 'False' by default
+    :type block: bool
     """
     def __init__(self, num_nodes, lmp_exec="lmp", lmp_args={}, slurm_args={},
                  procs_per_node=16, generate_jobscript=True,
-                 jobscript="job.sh"):
+                 jobscript="job.sh", block=False):
         self.num_nodes = num_nodes
         self.num_procs = num_nodes * procs_per_node
         self.lmp_exec = lmp_exec
+        if jobscript is None and not generate_jobscript:
+            raise ValueError("A jobscript filename is needed when the jobscript is not generated")
         self.generate_jobscript = generate_jobscript
         self.jobscript = jobscript
+        self.block = block
         self.slurm = True
 
         default_slurm_args = {"job-name": "CPU-job",
                               "partition": "normal",
                               "ntasks": str(self.num_procs),
                               "nodes": str(self.num_nodes),
-                              "output": "slurm.out",
+                              "output": "slurm-%j.out",
+                              "open-mode": "append",
                               }
 
         self.slurm_args = {**default_slurm_args, **slurm_args}
         self.lmp_args = lmp_args
+        self._queue = []
 
     def __str__(self):
         return "CPU (slurm)"
 
-    def __call__(self, lmp_script, lmp_var, stdout, stderr):
-        self.lmp_args["-in"] = lmp_script
-
-        if self.generate_jobscript:
-            exec_list = self.get_exec_list(self.num_procs, self.lmp_exec, self.lmp_args, lmp_var)
-            self.gen_jobscript(exec_list, self.jobscript, self.slurm_args)
-        output = str(subprocess.check_output(["sbatch", self.jobscript], stderr=stderr))
-        job_id = int(re.findall("([0-9]+)", output)[0])
-        print(f"Simulation started with job ID {job_id}")
-        return job_id
-
 
 class SlurmGPU(Computer):
     """Run LAMMPS simulations on GPU cluster with the Slurm queueing system.
@@ -302,16 +539,23 @@ class SlurmGPU(Computer):
     :type slurm_args: dict
     :param generate_jobscript: whether or not jobscript should be generated, 'True' by default
     :type generate_jobscript: bool
-    :param jobscript: filename of jobscript, 'job.sh' by default
+    :param jobscript: filename of jobscript, 'job.sh' by default. If None, the generated jobscript is kept in a temporary file on tmpfs
     :type jobscript: str
+    :param block: whether or not to wait for the job to finish, using 'sbatch --wait', 'False' by default
+    :type block: bool
     """
+    _LMP_TEMPLATES = GPU._LMP_TEMPLATES
+
     def __init__(self, gpu_per_node=1, lmp_exec="lmp", lmp_args={},
                  slurm_args={}, generate_jobscript=True, jobscript="job.sh",
-                 mode="kokkos"):
+                 mode="kokkos", block=False):
         self.gpu_per_node = gpu_per_node
         self.lmp_exec = lmp_exec
+        if jobscript is None and not generate_jobscript:
+            raise ValueError("A jobscript filename is needed when the jobscript is not generated")
         self.generate_jobscript = generate_jobscript
         self.jobscript = jobscript
+        self.block = block
         self.slurm = True
 
         default_slurm_args = {"job-name": "GPU-job",
@@ -319,32 +563,22 @@ class SlurmGPU(Computer):
                               "ntasks": str(self.gpu_per_node),
                               "cpus-per-task": "2",
                               "gres": "gpu:" + str(self.gpu_per_node),
-                              "output": "slurm.out",
+                              "output": "slurm-%j.out",
+                              "open-mode": "append",
                               }
 
-        if mode == "kokkos":
-            default_lmp_args = {"-pk": "kokkos newton on neigh full",
-                                "-k": f"on g {self.gpu_per_node}",
-                                "-sf": "kk"}
-        elif mode == "gpu":
-            default_lmp_args = {"-pk": "gpu newton on neigh full",
-                                "-sf": "gpu"}
-        else:
+        if mode not in self._LMP_TEMPLATES:
             raise NotImplementedError
+        default_lmp_args = {key: setting.format(gpu_per_node=self.gpu_per_node)
+                            for key, setting in self._LMP_TEMPLATES[mode]}
 
         self.lmp_args = {**default_lmp_args, **lmp_args}    # merge
         self.slurm_args = {**default_slurm_args, **slurm_args}
+        self._queue = []
 
     def __str__(self):
         return "GPU (slurm)"
 
-    def __call__(self, lmp_script, lmp_var, stdout, stderr):
-        self.lmp_args["-in"] = lmp_script
-
-        if self.generate_jobscript:
-            exec_list = self.get_exec_list(self.gpu_per_node, self.lmp_exec, self.lmp_args, lmp_var)
-            self.gen_jobscript(exec_list, self.jobscript, self.slurm_args)
-        output = str(subprocess.check_output(["sbatch", self.jobscript], stderr=stderr))
-        job_id = int(re.findall("([0-9]+)", output)[0])
-        print(f"Simulation started with job ID {job_id}")
-        return job_id
+    @property
+    def _np(self):
+        return self.gpu_per_node
@@ -1,8 +1,115 @@
 import re
 import subprocess
-from numpy import ndarray
 import os 
+import copy
+import select
+import logging
 import warnings
+import threading
+from itertools import count
+from types import MappingProxyType
+from functools import lru_cache
+from .ssh import ssh_command, start_master, stop_master, parse_target
+
+try:
+    import pyslurm
+except ImportError:
+    pyslurm = None
+
+logger = logging.getLogger(__name__)
+
+
+def _is_index_variable(value):
+    """Whether or not a variable is a LAMMPS index variable, given as a
+    list, tuple or array. Arrays are duck-typed to avoid importing NumPy
+
+    :param value: value of variable
+    :type value: any
+    :rtype: bool
+    """
+    return isinstance(value, (list, tuple)) or getattr(value, "ndim", 0) > 0
+
+
+def _index_strings(value):
+    """Convert the values of an index variable to strings. NumPy arrays are
+    converted in a single C loop
+
+    :param value: values of index variable
+    :type value: list, tuple or ndarray
+    :rtype: list of str
+    """
+    if hasattr(value, "astype"):
+        return value.astype(str).tolist()
+    return list(map(str, value))
+
+
+_RUNNING = {}    # process-ID -> Popen of direct runs kept by keep_runs
+_PENDING = {}    # index -> (host, wd, jobscript_name, jobscript) of remote jobs held back by batch_remote
+_PENDING_LOCK = threading.Lock()
+_PENDING_INDEX = count()    # indices stay unique across flushes
+_JOBID_RE = re.compile(rb"(\d+)")
+
+
+def _parse_job_id(output):
+    """Get job-ID from sbatch output, which is on the form {job-ID} with
+    --parsable and 'Submitted batch job {job-ID}' otherwise. Other outputs
+    fall back to the first number found
+
+    :param output: output of sbatch
+    :type output: bytes
+    :returns: job-ID
+    :rtype: int
+    """
+    try:
+        return int(output.split()[-1])
+    except (ValueError, IndexError):
+        return int(_JOBID_RE.search(output).group(1))
+
+
+@lru_cache(maxsize=64)
+def _exec_prefix(mpi_args, lmp_exec, lmp_args, mpirun=True):
+    """Making the part of the mpirun arguments that does not depend on the
+    LAMMPS variables, which is shared by all simulations of a sweep:
+
+        tuple = ('mpirun', {mpi_args}, {lmp_exec}, {lmp_args})
+
+    :param mpi_args: mpirun/mpiexec command line arguments as (key, value) pairs
+    :type mpi_args: tuple
+    :param lmp_exec: LAMMPS executable
+    :type lmp_exec: str
+    :param lmp_args: LAMMPS command line arguments as (key, value) pairs
+    :type lmp_args: tuple
+    :param mpirun: whether or not to launch with mpirun, 'True' by default. mpi_args is ignored if not
+    :type mpirun: bool
+    :returns: mpirun executables
+    :rtype: tuple of str
+    """
+    def flatten(args):
+        return [arg for key, setting in args
+                for arg in (key, *(() if setting is None else str(setting).split()))]
+    launcher = ("mpirun", *flatten(mpi_args)) if mpirun else ()
+    return (*launcher, lmp_exec, *flatten(lmp_args))
+
+
+@lru_cache(maxsize=64)
+def _sbatch_header(slurm_args):
+    """Making the part of the jobscript that does not depend on the
+    simulation, which is shared by all simulations of an ensemble:
+
+        #!/bin/bash
+        #SBATCH --{key1}={value1}
+        ...
+
+    :param slurm_args: slurm sbatch command line arguments as (key, value) pairs
+    :type slurm_args: tuple
+    :returns: jobscript header
+    :rtype: str
+    """
+    parts = ["#!/bin/bash\n\n"]
+    parts += [f"#SBATCH --{key}\n#\n" if setting is None else f"#SBATCH --{key}={setting}\n#\n"
+              for key, setting in slurm_args]
+    parts.append("\n")
+    return "".join(parts)
 
 
 class Device:
@@ -28,10 +135,17 @@ class Device:
     :type execute: bool
     :param activate_virtual: Activate virtual cores
     :type activate_virtual: bool
+    :param batch_remote: whether or not to hold back remote Slurm jobs until Device.flush is called. By default, remote Slurm jobs are held back if the environment variable LAMMPS_SIM_BATCH is set to 1.
+    :type batch_remote: bool
+    :param force_mpirun: whether or not to launch single-process runs with mpirun, 'False' by default. If not, LAMMPS is executed directly when the only mpi argument is '-n 1'.
+    :type force_mpirun: bool
+    :param keep_runs: whether or not to keep direct runs, such that they can be waited for by Device.wait, 'False' by default. Kept runs should be waited for, otherwise they are not reaped when they finish.
+    :type keep_runs: bool
     """
     def __init__(self, num_procs=1, mpi_args={}, lmp_exec="lmp", lmp_args={},
                  slurm=False, slurm_args={}, write_jobscript=True, jobscript_name="job.sh",
-                 execute = True, activate_virtual=False):
+                 execute = True, activate_virtual=False, batch_remote=None, force_mpirun=False,
+                 keep_runs=False):
         
         self.num_procs = num_procs
         self.lmp_exec = lmp_exec
@@ -44,6 +158,11 @@ class Device:
         self.jobscript_name = jobscript_name 
         self.execute = execute
         self.activate_virtual = activate_virtual
+        if batch_remote is None:
+            batch_remote = os.environ.get("LAMMPS_SIM_BATCH") == "1"
+        self.batch_remote = batch_remote
+        self.force_mpirun = force_mpirun
+        self.keep_runs = keep_runs
         
         # create default mpirun/mpiexec argument dictionary and merge
         default_mpi_args = {'-n' : num_procs}
@@ -69,74 +188,353 @@ class Device:
         :type lmp_script: str
         :param lmp_var: LAMMPS lmp_variables defined by the command line
         :type lmp_var: dict
-        :returns: job-ID
+        :returns: job-ID, or index of the pending job if the job is held back by batch_remote
         :rtype: int
         """
         
-        if (":" in self.dir):
-            self.ssh, self.wd = self.dir.split(":")
-        else:
-            self.ssh = None
-            self.wd = self.dir
-
-        self.lmp_args["-in"] = lmp_script
-        exec_list = self.get_exec_list(self.mpi_args, self.lmp_exec, self.lmp_args, lmp_var)
+        self.ssh, self.wd = parse_target(self.dir)
+        if self.ssh is not None:
+            start_master(self.ssh)
+
+        lmp_args = {**self.lmp_args, "-in": lmp_script}
+        exec_list = self.get_exec_list(self.mpi_args, self.lmp_exec, lmp_args, lmp_var, self._mpirun)
+        # remote Slurm jobs are written and submitted together by Device.flush
+        pending = self.slurm and self.execute and self.batch_remote and self.ssh is not None
+        # generated jobscripts are piped to sbatch, the stored file is for inspection
+        submit_stdin = self.slurm and self.execute and self.write_jobscript
        
         if self.write_jobscript:
             if self.jobscript_string is None:
                 self.jobscript_string = self.gen_jobscript_string(exec_list, self.slurm_args)
             if self.ssh is None: # locally stored
                 self.store_jobscript(self.jobscript_string, self.wd + '/' + self.jobscript_name)    
-            else: # temporary locally stored
-                p = subprocess.Popen(['ssh', 'egil', f'cat - > {self.wd}/{self.jobscript_name}'], stdin=subprocess.PIPE)
-                p.communicate(input=str.encode(self.jobscript_string))
+            elif not (pending or submit_stdin): # streamed over the master connection
+                subprocess.run(ssh_command(self.ssh, f'cat - > {self.wd}/{self.jobscript_name}'),
+                               input=self.jobscript_string.encode(), check=True)
 
         if not self.execute: # Option to only generate jobscript
             return 0
         
+        if pending:
+            jobscript_string = self.jobscript_string if self.write_jobscript else None
+            with _PENDING_LOCK:
+                index = next(_PENDING_INDEX)
+                _PENDING[index] = (self.ssh, self.wd, self.jobscript_name, jobscript_string)
+            return index
+
         if self.slurm: # Run with slurm
-            if self.ssh is None: # Run locally
-                main_path = os.getcwd()
-                os.chdir(self.wd)
-                output = subprocess.check_output(["sbatch", self.jobscript_name])
-                os.chdir(main_path)
-            else: # Run on ssh 
-                output = subprocess.check_output(["ssh", self.ssh, f"cd {self.wd} && sbatch {self.jobscript_name}"])
-            
-            job_id = int(re.findall("([0-9]+)", str(output))[0])
-            print(f"Job submitted with job ID {job_id}")
+            if self.ssh is None and pyslurm is not None: # Submit through libslurm
+                job_id = self._submit_slurm(os.path.join(self.wd, self.jobscript_name), self.wd)
+            else:
+                if self.ssh is None and submit_stdin: # Run locally
+                    output = subprocess.check_output(["sbatch", "--parsable"], cwd=self.wd,
+                                                     input=self.jobscript_string.encode())
+                elif self.ssh is None:
+                    output = subprocess.check_output(["sbatch", "--parsable", self.jobscript_name], cwd=self.wd)
+                elif submit_stdin: # Run on ssh, storing the jobscript on the way
+                    output = subprocess.check_output(ssh_command(self.ssh, f"cd {self.wd} && tee {self.jobscript_name} | sbatch --parsable"),
+                                                     input=self.jobscript_string.encode())
+                else:
+                    output = subprocess.check_output(ssh_command(self.ssh, f"cd {self.wd} && sbatch --parsable {self.jobscript_name}"))
+                job_id = _parse_job_id(output)
+            logger.info("Job submitted with job ID %d", job_id)
             return job_id
             
       
         else: # Run directly 
             if self.ssh is None: 
-                main_path = os.getcwd()
-                os.chdir(self.wd)
-                procs = subprocess.Popen(exec_list, stdout=stdout, stderr=stderr)
-                os.chdir(main_path)
+                procs = subprocess.Popen(exec_list, stdout=stdout, stderr=stderr, cwd=self.wd)
             else:
-                procs = subprocess.Popen(["ssh", self.ssh, f"cd {self.wd} && {' '.join(exec_list)}"], stdout=stdout, stderr=stderr)
+                procs = subprocess.Popen(ssh_command(self.ssh, f"cd {self.wd} && {' '.join(exec_list)}"), stdout=stdout, stderr=stderr)
             pid = procs.pid
-            print(f"Simulation started with process ID {pid}")
+            # runs that are not kept are reaped by subprocess
+            if self.keep_runs:
+                _RUNNING[pid] = procs
+            logger.info("Simulation started with process ID %d", pid)
             return pid
         
         
         
  
+    def close(self):
+        """Close the ssh master connection to the remote host of the last
+        call, if any. Otherwise, the connection exits by itself when it has
+        been unused for a while. Remote direct runs that are still running
+        are kept, as the master only stops accepting new sessions. Later
+        calls to the host open a new master connection
+        """
+        if getattr(self, "ssh", None) is not None:
+            stop_master(self.ssh)
+
+
+    @staticmethod
+    def wait(pids):
+        """Wait for direct runs started with keep_runs=True to finish. The
+        processes are waited for together by polling their pidfds with
+        epoll, falling back to waiting for one at a time where pidfds are
+        not available (Linux 5.3+ and Python 3.9+ are needed). Piped output
+        is read and discarded while waiting, as a full pipe would block the
+        process
+
+        :param pids: process-ID(s) returned when the simulations were started
+        :type pids: int or list of int
+        :returns: return code, or return code of each simulation by process-ID
+        :rtype: int or dict
+        """
+        single = isinstance(pids, int)
+        pids = [pids] if single else list(pids)
+        for pid in pids:
+            if pid not in _RUNNING:
+                raise ValueError(f"Process {pid} cannot be waited for, direct runs "
+                                 "are only kept with keep_runs=True")
+        procs = {pid: _RUNNING.pop(pid) for pid in pids}
+        for proc in procs.values():
+            if proc.stdout is not None or proc.stderr is not None:
+                proc.communicate()
+        if hasattr(os, "pidfd_open") and hasattr(select, "epoll"):
+            fds = {}
+            with select.epoll() as epoll:
+                try:
+                    for pid, proc in procs.items():
+                        if proc.returncode is not None:
+                            continue
+                        try:
+                            fd = os.pidfd_open(pid)
+                        except OSError:     # already reaped or not supported
+                            continue
+                        fds[fd] = pid
+                        epoll.register(fd, select.EPOLLIN)
+                    while fds:
+                        for fd, _ in epoll.poll():
+                            epoll.unregister(fd)
+                            os.close(fd)
+                            del fds[fd]
+                finally:
+                    for fd in fds:
+                        os.close(fd)
+        returncodes = {pid: proc.wait() for pid, proc in procs.items()}
+        return returncodes[pids[0]] if single else returncodes
+
+
+    def submit_many(self, jobs, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, max_workers=16):
+        """Start several simulations concurrently from a thread pool, such
+        that the sbatch and ssh round trips overlap. Every simulation is
+        started by its own shallow copy of the device, as calling a device
+        sets its directory
+
+        :param jobs: simulations given as (lmp_script, lmp_var, dir) tuples, where dir may be on the form {host}:{path}. A pre-generated jobscript may be given as a fourth element
+        :type jobs: list of tuple
+        :param stdout: where to write output from LAMMPS simulations
+        :type stdout: subprocess output object
+        :param stderr: where to write errors from LAMMPS simulations
+        :type stderr: subprocess output object
+        :param max_workers: maximum number of simultaneous submissions, 16 by default
+        :type max_workers: int
+        :returns: job-IDs, in the same order as jobs
+        :rtype: list of int
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        def submit(lmp_script, lmp_var, dir_, jobscript_string=None):
+            device = copy.copy(self)
+            device.dir = dir_
+            device.jobscript_string = jobscript_string
+            return device(lmp_script, lmp_var, stdout, stderr)
+
+        with ThreadPoolExecutor(max_workers=min(len(jobs), max_workers) or 1) as executor:
+            futures = [executor.submit(submit, *job) for job in jobs]
+            return [future.result() for future in futures]
+
+
+    @staticmethod
+    def flush():
+        """Submit the remote Slurm jobs held back by batch_remote, from all
+        devices. All jobscripts of a host are written and submitted by a
+        single remote shell, such that each host is only connected to once.
+        The shell of a host stops at the first job that fails. Jobs that
+        were not submitted get the job-ID None, and are held back until
+        the next flush, keeping their index
+
+        :returns: job-IDs of the pending jobs by the index returned when they were held back
+        :rtype: dict
+        """
+        with _PENDING_LOCK:
+            pending = dict(_PENDING)
+        commands = {}   # host -> [(index, command)]
+        for i, (host, wd, jobscript_name, jobscript_string) in pending.items():
+            # every job runs in its own subshell, such that relative
+            # directories are resolved from the login directory
+            command = f"( cd {wd}\n"
+            if jobscript_string is not None:
+                command += f"cat > {jobscript_name} <<'LAMMPS_SIMULATOR_EOF'\n{jobscript_string}"
+                command += "" if jobscript_string.endswith("\n") else "\n"
+                command += "LAMMPS_SIMULATOR_EOF\n"
+            command += f"sbatch --parsable {jobscript_name} )\n"
+            commands.setdefault(host, []).append((i, command))
+
+        job_ids = dict.fromkeys(pending)
+        for host, host_commands in commands.items():
+            script = "set -e\n" + "".join(command for _, command in host_commands)
+            res = subprocess.run(ssh_command(host, "bash -s"), input=script.encode(), stdout=subprocess.PIPE)
+            # the jobs before a failing one are submitted, and print their job-IDs
+            lines = res.stdout.split()
+            for (i, _), line in zip(host_commands, lines):
+                # --parsable prints {job-ID} or {job-ID};{cluster}
+                job_ids[i] = int(line.split(b";")[0])
+            if res.returncode != 0:
+                logger.error("Submission to %s failed, %d of %d jobs are still held back",
+                             host, len(host_commands) - len(lines), len(host_commands))
+            else:
+                logger.info("%d jobs submitted to %s", len(host_commands), host)
+        with _PENDING_LOCK:
+            for i, job_id in job_ids.items():
+                if job_id is not None:
+                    del _PENDING[i]
+        return job_ids
+
+
+    def submit_batch(self, jobs, submit_dir=None):
+        """Submit several simulations as one Slurm array job, such that
+        sbatch is only called once. The jobscript dispatches on
+        $SLURM_ARRAY_TASK_ID:
+
+            case $SLURM_ARRAY_TASK_ID in
+            0) cd {wd_0} && mpirun {mpi_args} {lmp_exec} -in {lmp_script_0} ... ;;
+            1) cd {wd_1} && mpirun {mpi_args} {lmp_exec} -in {lmp_script_1} ... ;;
+            ...
+            esac
+
+        :param jobs: simulations given as (lmp_script, lmp_var, wd) tuples
+        :type jobs: list of tuple
+        :param submit_dir: directory to store the jobscript in and submit from, the current working directory by default
+        :type submit_dir: str
+        :returns: job-IDs of the array tasks, on the form {job-ID}_{task-ID}
+        :rtype: list of str
+        """
+        tasks = []
+        for i, (lmp_script, lmp_var, wd) in enumerate(jobs):
+            lmp_args = {**self.lmp_args, "-in": lmp_script}
+            exec_list = self.get_exec_list(self.mpi_args, self.lmp_exec, lmp_args, lmp_var, self._mpirun)
+            tasks.append(f"{i}) cd {wd} && {' '.join(exec_list)} ;;\n")
+        dispatch = f"case $SLURM_ARRAY_TASK_ID in\n{''.join(tasks)}esac"
+        slurm_args = {**self.slurm_args, "array": f"0-{len(jobs) - 1}"}
+        jobscript_string = self.gen_jobscript_string([dispatch], slurm_args)
+
+        job_id = self._submit_jobscript(jobscript_string, submit_dir)
+        logger.info("Array job with %d simulations submitted with job ID %d", len(jobs), job_id)
+        return [f"{job_id}_{i}" for i in range(len(jobs))]
+
+
+    def submit_ensemble(self, jobs, procs_per_job=1, submit_dir=None):
+        """Run several small simulations concurrently within a single Slurm
+        allocation. Every simulation is started as its own job step with
+        srun, such that the simulations do not queue separately:
+
+            (cd {wd_0} && srun --exact -n {procs_per_job} {lmp_exec} -in {lmp_script_0} ...) &
+            (cd {wd_1} && srun --exact -n {procs_per_job} {lmp_exec} -in {lmp_script_1} ...) &
+            ...
+            wait
+
+        The number of tasks of the allocation is set to fit all simulations,
+        while the number of nodes is kept from slurm_args.
+        'srun --exact' requires Slurm 21.08 or newer.
+
+        :param jobs: simulations given as (lmp_script, lmp_var, wd) tuples
+        :type jobs: list of tuple
+        :param procs_per_job: number of processes of each simulation, 1 by default
+        :type procs_per_job: int
+        :param submit_dir: directory to store the jobscript in and submit from, the current working directory by default
+        :type submit_dir: str
+        :returns: job-ID
+        :rtype: int
+        """
+        steps = []
+        for lmp_script, lmp_var, wd in jobs:
+            lmp_args = {**self.lmp_args, "-in": lmp_script}
+            # launched by srun instead of mpirun, as the simulation is a job step
+            exec_list = self.get_exec_list({}, self.lmp_exec, lmp_args, lmp_var, mpirun=False)
+            steps.append(f"(cd {wd} && srun --exact -n {procs_per_job} {' '.join(exec_list)}) &\n")
+        steps.append("wait")
+        slurm_args = {**self.slurm_args, "ntasks": str(len(jobs) * procs_per_job)}
+        jobscript_string = self.gen_jobscript_string(["".join(steps)], slurm_args)
+
+        job_id = self._submit_jobscript(jobscript_string, submit_dir)
+        logger.info("Ensemble of %d simulations submitted with job ID %d", len(jobs), job_id)
+        return job_id
+
+
+    def _submit_jobscript(self, jobscript_string, submit_dir=None):
+        """Store jobscript and submit it locally
+
+        :param jobscript_string: content of jobscript
+        :type jobscript_string: str
+        :param submit_dir: directory to store the jobscript in and submit from, the current working directory by default
+        :type submit_dir: str
+        :returns: job-ID
+        :rtype: int
+        """
+        submit_dir = submit_dir or os.getcwd()
+        self.store_jobscript(jobscript_string, os.path.join(submit_dir, self.jobscript_name))
+        if pyslurm is not None:
+            return self._submit_slurm(os.path.join(submit_dir, self.jobscript_name), submit_dir)
+        output = subprocess.check_output(["sbatch", "--parsable"], cwd=submit_dir,
+                                         input=jobscript_string.encode())
+        return _parse_job_id(output)
+
+
+    @staticmethod
+    def _submit_slurm(jobscript, wd):
+        """Submit jobscript in-process through libslurm with PySlurm,
+        instead of calling sbatch. The #SBATCH options are read from the
+        jobscript
+
+        :param jobscript: path to jobscript
+        :type jobscript: str
+        :param wd: working directory of job
+        :type wd: str
+        :returns: job-ID
+        :rtype: int
+        """
+        desc = pyslurm.JobSubmitDescription(script=jobscript, working_directory=wd)
+        desc.load_sbatch_options()
+        return desc.submit()
+
+
     @staticmethod
     def store_jobscript(string, path): 
         # Might find better name but used 'write_jobscript' for bool value
-        with open(path, "w") as f:
-            f.write(string)
+        # written with a single os.write, skipping the buffered text layer,
+        # and created executable such that it can also be run without sbatch
+        data = string.encode() if isinstance(string, str) else string
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o755)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
              
 
+    @property
+    def _mpirun(self):
+        """Whether or not to launch with mpirun. Single-process runs are
+        executed directly, saving the start-up of mpirun, unless
+        force_mpirun is set
+        """
+        if self.force_mpirun or list(self.mpi_args) != ["-n"]:
+            return True
+        return str(self.mpi_args["-n"]) != "1"
+
+
     @staticmethod
-    def get_exec_list(mpi_args, lmp_exec, lmp_args, lmp_var):
+    def get_exec_list(mpi_args, lmp_exec, lmp_args, lmp_var, mpirun=True):
         """Making a list with all mpirun arguments:
 
             list = ['mpirun', {mpi_args}, {lmp_exec}, '-in',
                     {lmp_script}, {lmp_args}, {lmp_var}]
 
+        or without mpirun and mpi_args if mpirun is False
+
         :param mpi_args: mpirun/mpiexec command line arguments
         :type mpi_args: dict
         :param lmp_exec: LAMMPS executable
@@ -145,27 +543,21 @@ class Device:
         :type lmp_args: dict
         :param lmp_var: LAMMPS variables defined by the command line
         :type lmp_var: dict
+        :param mpirun: whether or not to launch with mpirun, 'True' by default
+        :type mpirun: bool
         :returns: list with mpirun executables
         :rtype: list of str
         """
        
-        exec_list = ["mpirun"]
-        for key, setting in mpi_args.items():
-            exec_list.append(key)
-            if setting is not None:
-                exec_list.extend(str(setting).split())
-        exec_list += [lmp_exec]
-        for key, setting in lmp_args.items():
-            exec_list.append(key)
-            if setting is not None:
-                exec_list.extend(str(setting).split())
-        for key, setting in lmp_var.items():
-            # variable may be a LAMMPS index variable
-            if type(setting) in [list, tuple, ndarray]:
-                exec_list.extend(["-var", key])
-                exec_list.extend(map(str, list(setting)))
-            else:
-                exec_list.extend(["-var", key, str(setting)])
+        mpi_args, lmp_args = tuple(mpi_args.items()), tuple(lmp_args.items())
+        try:
+            exec_list = list(_exec_prefix(mpi_args, lmp_exec, lmp_args, mpirun))
+        except TypeError:   # unhashable argument, cannot be cached
+            exec_list = list(_exec_prefix.__wrapped__(mpi_args, lmp_exec, lmp_args, mpirun))
+        # variable may be a LAMMPS index variable
+        exec_list += [arg for key, setting in lmp_var.items()
+                      for arg in ("-var", key, *(_index_strings(setting) if _is_index_variable(setting)
+                                                 else (str(setting),)))]
         return exec_list
 
  
@@ -186,17 +578,12 @@ class Device:
         :type slurm_args: dict
         """
         
-        string = "#!/bin/bash\n\n"
-        for key, setting in slurm_args.items():
-            if setting is None:
-                string += f"#SBATCH --{key}\n#\n"
-            else:
-                string += f"#SBATCH --{key}={setting}\n#\n"
-        string += "\n"
-        string += " ".join(exec_list)
-        if linebreak:
-            string += "\n"
-        return string
+        slurm_args = tuple(slurm_args.items())
+        try:
+            header = _sbatch_header(slurm_args)
+        except TypeError:   # unhashable argument, cannot be cached
+            header = _sbatch_header.__wrapped__(slurm_args)
+        return "".join([header, " ".join(exec_list), "\n" if linebreak else ""])
         
 
 
@@ -217,20 +604,25 @@ class GPU(Device):
     :param mode: GPU mode, has to be either 'kokkos' or 'gpu', 'kokkos' by default
     :type mode: str
     """
+    # default LAMMPS arguments of each mode, formatted with gpu_per_node
+    _MODE_ARGS = MappingProxyType({
+        "kokkos": MappingProxyType({"-pk": "kokkos newton on neigh full",
+                                    "-k": "on g {gpu_per_node}",
+                                    "-sf": "kk"}),
+        "gpu": MappingProxyType({"-pk": "gpu {gpu_per_node}",
+                                 "-sf": "gpu"}),
+    })
+
     def __init__(self, gpu_per_node=1, mode="kokkos", **kwargs):
         super().__init__(**kwargs)
         self.gpu_per_node = gpu_per_node
 
-        if mode == "kokkos":
-            default_lmp_args = {"-pk": "kokkos newton on neigh full",
-                                "-k": f"on g {self.gpu_per_node}",
-                                "-sf": "kk"}
-        elif mode == "gpu":
-            default_lmp_args = {
-                "-pk": f"gpu {self.gpu_per_node}",
-                "-sf": "gpu"}
-        else:
-            raise NotImplementedError
+        try:
+            mode_args = self._MODE_ARGS[mode]
+        except KeyError:
+            raise NotImplementedError(f"GPU mode '{mode}' is not supported") from None
+        default_lmp_args = {key: setting.format(gpu_per_node=self.gpu_per_node)
+                            for key, setting in mode_args.items()}
 
         self.lmp_args = {**default_lmp_args, **self.lmp_args}    # merge
 
@@ -244,19 +636,22 @@ class SlurmCPU(Device):
     :param procs_per_node: number of processes per node, 16 by default
     :type procs_per_node: int
     """
+    # defaults that do not depend on the instance, shared by all instances
+    _DEFAULT_SLURM_ARGS = MappingProxyType({"job-name": "CPU-job",
+                                            "partition": "normal",
+                                            "output": "slurm-%j.out",
+                                            "open-mode": "append",
+                                            })
+
     def __init__(self, num_nodes, procs_per_node=16, slurm=True, **kwargs):
         super().__init__(slurm=slurm, **kwargs)
         self.num_nodes = num_nodes
         self.num_procs = num_nodes * procs_per_node
 
-        default_slurm_args = {"job-name": "CPU-job",
-                              "partition": "normal",
-                              "ntasks": str(self.num_procs),
-                              "nodes": str(self.num_nodes),
-                              "output": "slurm.out",
-                              }
-
-        self.slurm_args = {**default_slurm_args, **self.slurm_args}
+        self.slurm_args = {**self._DEFAULT_SLURM_ARGS,
+                           "ntasks": str(self.num_procs),
+                           "nodes": str(self.num_nodes),
+                           **self.slurm_args}
 
     def __str__(self):
         return "CPU (slurm)"
@@ -270,31 +665,31 @@ class SlurmGPU(Device):
     :param mode: GPU mode, has to be either 'kokkos' or 'gpu', 'kokkos' by default
     :type mode: str
     """
+    _MODE_ARGS = GPU._MODE_ARGS
+    # defaults that do not depend on the instance, shared by all instances
+    _DEFAULT_SLURM_ARGS = MappingProxyType({"job-name": "GPU-job",
+                                            "partition": "normal",
+                                            "cpus-per-task": "2",
+                                            "output": "slurm-%j.out",
+                                            "open-mode": "append",
+                                            })
+
     def __init__(self, gpu_per_node=1, mode="kokkos", slurm=True, **kwargs):
         super().__init__(slurm=slurm, **kwargs)
         self.gpu_per_node = gpu_per_node
 
-        default_slurm_args = {"job-name": "GPU-job",
-                              "partition": "normal",
-                              "ntasks": str(self.gpu_per_node),
-                              "cpus-per-task": "2",
-                              "gres": "gpu:" + str(self.gpu_per_node),
-                              "output": "slurm.out",
-                              }
-
-        if mode == "kokkos":
-            default_lmp_args = {"-pk": "kokkos newton on neigh full",
-                                "-k": f"on g {self.gpu_per_node}",
-                                "-sf": "kk"}
-        elif mode == "gpu":
-            default_lmp_args = {
-                "-pk": f"gpu {self.gpu_per_node}",
-                "-sf": "gpu"}
-        else:
-            raise NotImplementedError
+        try:
+            mode_args = self._MODE_ARGS[mode]
+        except KeyError:
+            raise NotImplementedError(f"GPU mode '{mode}' is not supported") from None
+        default_lmp_args = {key: setting.format(gpu_per_node=self.gpu_per_node)
+                            for key, setting in mode_args.items()}
 
         self.lmp_args = {**default_lmp_args, **self.lmp_args}    # merge
-        self.slurm_args = {**default_slurm_args, **self.slurm_args}
+        self.slurm_args = {**self._DEFAULT_SLURM_ARGS,
+                           "ntasks": str(self.gpu_per_node),
+                           "gres": "gpu:" + str(self.gpu_per_node),
+                           **self.slurm_args}
 
     def __str__(self):
         return "GPU (slurm)"
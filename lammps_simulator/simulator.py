@@ -1,7 +1,84 @@
 import os
+import re
+import errno
+import logging
+import shlex
 import shutil
 import warnings
 import subprocess
+from pathlib import Path
+from .ssh import ssh_command, rsync_command, start_master, parse_target
+from .device import Device, _parse_job_id
+
+logger = logging.getLogger(__name__)
+
+_COPY_BUFSIZE = 1 << 20  # 1 MiB, restart and data files are often large
+_VAR_RE = re.compile(r"\$\{(\w+)\}|\$(\w)")   # ${name} or $x in LAMMPS scripts
+
+
+def _kernel_copy(fd_in, fd_out, size):
+    """Copy size bytes between file descriptors in kernel space, using
+    os.copy_file_range where supported (which may even share blocks or
+    copy server-side on NFS), and os.sendfile otherwise
+
+    :param fd_in: file descriptor to copy from
+    :type fd_in: int
+    :param fd_out: file descriptor to copy to
+    :type fd_out: int
+    :param size: number of bytes to copy
+    :type size: int
+    """
+    offset = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while offset < size:
+                copied = os.copy_file_range(fd_in, fd_out, size - offset, offset)
+                if copied == 0:
+                    break
+                offset += copied
+            return
+        except OSError:
+            pass    # not supported across file systems on older kernels
+    while offset < size:
+        sent = os.sendfile(fd_out, fd_in, offset, size - offset)
+        if sent == 0:
+            break
+        offset += sent
+
+
+def _copy_file(src, dst, hardlink=True):
+    """Copy file from src to dst. The file is hard linked if possible,
+    otherwise it is copied in kernel space using os.copy_file_range or
+    os.sendfile. Falls back to a buffered copy if neither is supported.
+
+    :param src: source file
+    :type src: str
+    :param dst: destination file
+    :type dst: str
+    :param hardlink: whether or not to hard link the file, 'True' by default
+    :type hardlink: bool
+    """
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            if hardlink or os.path.realpath(src) == os.path.realpath(dst):
+                return
+        os.remove(dst)  # never write through an existing link to src
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+    if hasattr(os, "sendfile"):
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                _kernel_copy(fsrc.fileno(), fdst.fileno(), os.fstat(fsrc.fileno()).st_size)
+            return
+        except OSError:
+            pass    # sendfile does not support regular files on all platforms
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        shutil.copyfileobj(fsrc, fdst, _COPY_BUFSIZE)
 
 
 class Simulator:
@@ -11,75 +88,164 @@ class Simulator:
     :type directory: str
     :param overwrite: whether or not working directory should be overwritten, 'False' by default
     :type overwrite: bool
+    :param defer_copy: whether or not to hold back copies to a remote working directory until the simulation is run, such that all files are sent by a single rsync, 'False' by default
+    :type defer_copy: bool
     """
 
-    from .device import Device
+    Device = Device     # kept as attribute for backward compatibility
 
-    def __init__(self, directory='.', overwrite=False):
-        self.jobscript_string = None # Option to store jobscript in simulator class
+    def __init__(self, directory='.', overwrite=False, defer_copy=False):
+        self._jobscript_parts = None # Option to store jobscript in simulator class
+        self._jobscript_args = None  # arguments of a jobscript not generated yet
+        self.defer_copy = defer_copy
+        self._pending_copies = []   # files to be sent to remote working directory
+        self._inputs = set()    # names of input files copied to working directory
         self.full_dir = directory
         
-        if (":" in directory):
-            self.ssh, self.wd = directory.split(":")
-        else:
-            self.ssh = None
-            self.wd = directory
+        self.ssh, self.wd = parse_target(directory)
+        if self.ssh is not None:
+            start_master(self.ssh)  # reused by all following ssh and rsync calls
         if overwrite:
-            self._make_dir(self.wd, self.ssh)
+            self._make_dir(self.wd, self.ssh, exist_ok=True)
+        elif self.ssh is None:
+            self.wd = self._make_free_dir(self.wd)
         else:
-            ext = 0
-            repeat = True
-            original_dir = self.wd
-            while repeat:
-                repeat = self._make_dir(self.wd, self.ssh)
-                if repeat:
-                    ext += 1
-                    self.wd = original_dir + f"_{ext}"
-        self.wd += "/"
+            self.wd = self._make_free_remote_dir(self.wd, self.ssh)
+        self.wd_path = Path(self.wd)
+        self.wd += "/"  # kept for backward compatibility, prefer wd_path
+        self._known_dirs = {os.path.normpath(self.wd)}   # directories known to exist
+        # rsync destination of the working directory, built once
+        self._remote_prefix = f"{self.ssh}:{self.wd}" if self.ssh else None
 
     @staticmethod
-    def _make_dir(dir_, host):
+    def _make_dir(dir_, host, exist_ok=False):
         """Make directory, which might be on a remote node
 
         :param dir_: directory
         :type dir_: str
         :param host: base host for simulation
         :type host: str
+        :param exist_ok: whether or not an existing local directory is accepted, 'False' by default. Remote directories are made by mkdir -p, see _make_free_remote_dir for free remote directories
+        :type exist_ok: bool
         :returns: True if directory exists, False if not
         :rtype: bool
         """
+        if host is None:
+            try:
+                os.makedirs(dir_, exist_ok=exist_ok)
+            except FileExistsError:
+                return True
+            return False
+        subprocess.run(ssh_command(host, 'mkdir', '-p', dir_), stdout=subprocess.DEVNULL)
+        return False
+
+    @staticmethod
+    def _make_free_dir(dir_):
+        """Make local directory. If the directory already exists, the
+        parent directory is scanned once for siblings named {dir_}_{ext}
+        and the directory {dir_}_{max(ext)+1} is made instead
+
+        :param dir_: directory
+        :type dir_: str
+        :returns: name of the directory that was made
+        :rtype: str
+        """
         try:
-            if host is None:
-                os.makedirs(dir_)
-            else:
-                res = subprocess.Popen(['ssh', host, 'mkdir', dir_], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                output, error = res.communicate()
-                if "File exists" in str(error): 
-                    raise FileExistsError
+            os.makedirs(dir_)
+            return dir_
         except FileExistsError:
-            return True
-        return False
-        
+            pass
+        dir_ = os.path.normpath(dir_)
+        parent, base = os.path.split(dir_)
+        pattern = re.compile(rf"^{re.escape(base)}_(\d+)$")
+        for _ in range(2):  # retry once if another process took the name
+            ext = 0
+            with os.scandir(parent or ".") as entries:
+                for entry in entries:
+                    match = pattern.match(entry.name)
+                    if match:
+                        ext = max(ext, int(match.group(1)))
+            new_dir = dir_ + f"_{ext + 1}"
+            try:
+                os.makedirs(new_dir)
+                return new_dir
+            except FileExistsError:
+                pass
+        raise FileExistsError(f"Could not make a free directory from '{dir_}'")
+
+    # probes {dir}, {dir}_1, {dir}_2, ... on the remote host and prints the
+    # suffix of the directory that was made
+    _FREE_DIR_SCRIPT = """
+if mkdir -- "$1" 2>/dev/null; then exit 0; fi
+[ -e "$1" ] || exit 1
+n=1
+while ! mkdir -- "$1_$n" 2>/dev/null; do
+    [ -e "$1_$n" ] || exit 1
+    n=$((n+1))
+done
+echo "_$n"
+"""
 
-    def copy_to_wd(self, *filename):
-        """Copy one or several files to working directory.
+    @classmethod
+    def _make_free_remote_dir(cls, dir_, host):
+        """Make directory on remote host. If the directory already exists,
+        {dir_}_1, {dir_}_2, ... are tried instead. All names are probed by
+        a single remote shell, such that only one round trip is needed
+
+        :param dir_: directory
+        :type dir_: str
+        :param host: remote host
+        :type host: str
+        :returns: name of the directory that was made
+        :rtype: str
+        """
+        res = subprocess.run(ssh_command(host, 'bash', '-s', '--', dir_), input=cls._FREE_DIR_SCRIPT.encode(),
+                             stdout=subprocess.PIPE)
+        if res.returncode != 0:
+            raise OSError(f"Could not make directory '{dir_}' on {host}")
+        return dir_ + res.stdout.decode().strip()
+
+
+    def copy_to_wd(self, *filename, hardlink=True):
+        """Copy one or several files to working directory. Local files are
+        hard linked when possible, set hardlink=False to always copy.
 
         :param filename: filename or tuple of filenames to copy
         :type filename: str or tuple of str
+        :param hardlink: whether or not to hard link local files, 'True' by default
+        :type hardlink: bool
         """
         if self.wd is None:
             warnings.warn("Working directory is not defined!")
         else:
-            for file in filename:
-                head, tail = os.path.split(file)
-                if self.ssh is None:
-                    try:
-                        shutil.copyfile(file, self.wd + tail)
-                    except shutil.SameFileError:
-                        pass
-                else:
-                    # use subprocess.run for transfer to finish before moving on
-                    subprocess.run(['rsync', '-av', file, self.ssh + ':' + self.wd + tail]) 
+            self._inputs.update(os.path.basename(file) for file in filename)
+            if self.ssh is None:
+                # later copies of a file with the same name win, and only
+                # one thread may write each destination
+                files = {os.path.basename(file): file for file in filename}
+                # copies are I/O bound, so overlap them in threads
+                from concurrent.futures import ThreadPoolExecutor
+                with ThreadPoolExecutor(max_workers=min(len(files), 8) or 1) as pool:
+                    futures = [pool.submit(_copy_file, file, self.wd_path / name, hardlink)
+                               for name, file in files.items()]
+                for future in futures:
+                    future.result()
+            elif self.defer_copy:
+                self._pending_copies.extend(filename)
+            elif filename:
+                # a single rsync transfers all files over one ssh connection,
+                # subprocess.run makes the transfer finish before moving on
+                subprocess.run(rsync_command('-av', *filename, self._remote_prefix))
+
+    def flush_copies(self):
+        """Send the files held back by defer_copy to the remote working
+        directory with a single rsync. Called when the simulation is run
+        """
+        if self._pending_copies:
+            # later copies of a file with the same name win, like for separate calls
+            files = list({os.path.basename(file): file for file in self._pending_copies}.values())
+            subprocess.run(rsync_command('-av', *files, self._remote_prefix))
+            self._pending_copies = []
                     
 
     def create_subdir(self, *dirname):
@@ -92,12 +258,31 @@ class Simulator:
 
         if self.wd is None:
             warnings.warn("Working directory is not defined!")
-        else:
-            for dir_ in dirname:
-                self._make_dir(self.wd + dir_, self.ssh)
+            return
+        # skip directories that are already made by this simulator
+        dirs = [os.path.normpath(os.path.join(self.wd, dir_)) for dir_ in dirname]
+        dirs = [dir_ for dir_ in dict.fromkeys(dirs) if dir_ not in self._known_dirs]
+        if self.ssh is None:
+            for dir_ in dirs:
+                self._make_dir(dir_, self.ssh, exist_ok=True)
+        elif dirs:
+            # all subdirectories are made by a single remote mkdir
+            subprocess.run(ssh_command(self.ssh, 'mkdir', '-p', *dirs))
+        for dir_ in dirs:
+            # parents are made by mkdir -p as well
+            while dir_ not in self._known_dirs and dir_ != os.path.dirname(dir_):
+                self._known_dirs.add(dir_)
+                dir_ = os.path.dirname(dir_)
+
+    def invalidate_cache(self):
+        """Forget which subdirectories are known to exist, such that they
+        are made again by create_subdir. Useful if directories may have been
+        removed behind the back of the simulator
+        """
+        self._known_dirs = {os.path.normpath(self.wd)}
                         
 
-    def set_input_script(self, filename, copy=True, **var):
+    def set_input_script(self, filename, copy=True, render=False, **var):
         """Set LAMMPS script
 
         :param filename: LAMMPS input script
@@ -106,21 +291,57 @@ class Simulator:
         :type var: dict
         :param copy: whether or not input script should be copied to working directory, 'True' by default
         :type copy: bool
+        :param render: whether or not to also substitute scalar variables directly into the copied script, 'False' by default. The variables are still passed by the command line, such that they override definitions in the script
+        :type render: bool
         """
         self.var = var
         if copy and self.wd is not None:
-            head, self.lmp_script = os.path.split(filename)
-            if self.ssh is None:
-                try:
-                    shutil.copyfile(filename, self.wd + self.lmp_script)
-                except shutil.SameFileError:
-                    pass
+            self.lmp_script = os.path.basename(filename)
+            self._inputs.add(self.lmp_script)
+            if render:
+                with open(filename) as f:
+                    script = f.read()
+                script = self._render_script(script, var)
+                if self.ssh is None:
+                    with open(self.wd_path / self.lmp_script, "w") as f:
+                        f.write(script)
+                else:
+                    subprocess.run(ssh_command(self.ssh, f'cat - > {self.wd}{self.lmp_script}'),
+                                   input=script.encode())
+            elif self.ssh is None:
+                _copy_file(filename, self.wd_path / self.lmp_script, hardlink=False)
+            elif self.defer_copy:
+                self._pending_copies.append(filename)
             else:
-                subprocess.run(['rsync', '-av', filename, self.ssh + ':' + self.wd + self.lmp_script]) 
+                subprocess.run(rsync_command('-av', filename, self._remote_prefix + self.lmp_script))
                 
         else:
             self.lmp_script = filename
 
+    @staticmethod
+    def _render_script(script, var):
+        """Substitute variables into LAMMPS script, replacing ${name}, and
+        $x for single-character names. Index variables (lists, tuples and
+        arrays) and values referring to shell variables, like
+        ${SLURM_ARRAY_TASK_ID}, cannot be rendered and are left as they are
+
+        :param script: content of LAMMPS script
+        :type script: str
+        :param var: LAMMPS variables
+        :type var: dict
+        :returns: rendered script
+        :rtype: str
+        """
+        scalars = {key: str(setting) for key, setting in var.items()
+                   if not isinstance(setting, (list, tuple)) and not hasattr(setting, "__array__")
+                   and "$" not in str(setting)}
+
+        def substitute(match):
+            name = match.group(1) or match.group(2)
+            return scalars.get(name, match.group(0))
+
+        return _VAR_RE.sub(substitute, script)
+
 
     def run(self, computer=None, device=None, stdout=subprocess.DEVNULL,
             stderr=subprocess.PIPE, activate_virtual=False, **kwargs):
@@ -139,23 +360,108 @@ class Simulator:
         """
 
         if computer is None and device is None:
-            device = self.Device(**kwargs)
+            device = Device(**kwargs)
         elif device is None:
             warnings.warn("'Computer' is deprecated from version 1.1.0 and is replaced by the more intuitive 'Device'", DeprecationWarning)
             device = computer
         
+        self.flush_copies()
         device.dir = self.full_dir
         device.ssh = self.ssh
-        device.jobscript_string = self.jobscript_string
+        # a pre-generated jobscript is only generated if the device writes it
+        device.jobscript_string = self.jobscript_string if device.write_jobscript else None
         job_id = device(self.lmp_script, self.var, stdout, stderr)   
-        try: 
-            if kwargs['execute'] == False:
-                print("Simulation.run() finished with \'execute = False\'")
-        except KeyError:
-            pass
+        if kwargs.get('execute', True) is False:
+            logger.info("Simulation.run() finished with 'execute = False'")
         
         return job_id
 
+    @classmethod
+    def run_many(cls, simulators, device=None, stdout=subprocess.DEVNULL,
+                 stderr=subprocess.PIPE, max_workers=16, **kwargs):
+        """Run several simulations concurrently, such that their sbatch and
+        ssh round trips overlap instead of adding up. See Device.submit_many
+
+        :param simulators: simulators with input scripts set
+        :type simulators: list of Simulator
+        :param device: device object specifying computation device
+        :type device: obj
+        :param stdout: where to write output from LAMMPS simulations. No output to terminal by default.
+        :type stdout: subprocess output object
+        :param stderr: where to write errors from LAMMPS simulations. Errors are written to terminal by default.
+        :type stderr: subprocess output object
+        :param max_workers: maximum number of simultaneous submissions, 16 by default
+        :type max_workers: int
+        :param kwargs: arguments to be passed to Device. Will only be used if device=None.
+        :type kwargs: unpacked dictionary
+        :returns: job-IDs, in the same order as simulators
+        :rtype: list of int
+        """
+        if device is None:
+            device = Device(**kwargs)
+        for sim in simulators:
+            sim.flush_copies()
+        # pre-generated jobscripts are only generated if the device writes them
+        jobs = [(sim.lmp_script, sim.var, sim._remote_prefix or sim.wd,
+                 sim.jobscript_string if device.write_jobscript else None)
+                for sim in simulators]
+        return device.submit_many(jobs, stdout, stderr, max_workers)
+
+    def run_array(self, var_key, values, device=None, **kwargs):
+        """Run a parameter sweep over a LAMMPS variable as a single Slurm
+        array job. Every task runs in its own subdirectory task_{i} of the
+        working directory, containing the input files copied to the working
+        directory by copy_to_wd and set_input_script, with the variable
+        var_key set to values[i]. Other files of the working directory, like
+        outputs of earlier runs, are not staged.
+
+        :param var_key: name of the LAMMPS variable to sweep
+        :type var_key: str
+        :param values: values of the variable, one array task per value
+        :type values: list
+        :param device: device object specifying computation device
+        :type device: obj
+        :param kwargs: arguments to be passed to Device. Will only be used if device=None.
+        :type kwargs: unpacked dictionary
+        :returns: job-ID of array job
+        :rtype: int
+        """
+        if device is None:
+            device = Device(slurm=True, **kwargs)
+        if len(values) == 0:
+            raise ValueError("Cannot run array job without values")
+        self.flush_copies()
+        num_tasks = len(values)
+
+        slurm_args = {**device.slurm_args, "array": f"0-{num_tasks - 1}"}
+        lmp_args = {**device.lmp_args, "-in": self.lmp_script}
+        lmp_var = {**self.var, var_key: "${values[$SLURM_ARRAY_TASK_ID]}"}
+        exec_list = device.get_exec_list(device.mpi_args, device.lmp_exec, lmp_args, lmp_var)
+        jobscript = device.gen_jobscript_string([], slurm_args)
+        jobscript += f"values=({' '.join(shlex.quote(str(value)) for value in values)})\n"
+        jobscript += "cd task_$SLURM_ARRAY_TASK_ID\n"
+        jobscript += " ".join(exec_list) + "\n"
+
+        if self.ssh is None:
+            for i in range(num_tasks):
+                task_dir = self.wd_path / f"task_{i}"
+                os.makedirs(task_dir, exist_ok=True)
+                for name in self._inputs:
+                    _copy_file(self.wd_path / name, task_dir / name)
+            device.store_jobscript(jobscript, self.wd_path / device.jobscript_name)
+            output = subprocess.check_output(["sbatch", device.jobscript_name], cwd=self.wd_path)
+        else:
+            # stage, store jobscript and submit in one ssh call
+            link = f" && ln -f -- {' '.join(map(shlex.quote, sorted(self._inputs)))} task_$i/" if self._inputs else ""
+            command = (f"cd {self.wd} && "
+                       f"for i in $(seq 0 {num_tasks - 1}); do mkdir -p task_$i{link} || exit 1; done && "
+                       f"cat - > {device.jobscript_name} && sbatch {device.jobscript_name}")
+            output = subprocess.check_output(ssh_command(self.ssh, command), input=jobscript.encode())
+
+        job_id = _parse_job_id(output)
+        logger.info("Array job submitted with job ID %d", job_id)
+        return job_id
+
    
     def pre_generate_jobscript(self, **kwargs):
         """ Pre-generate jobscript string from available information
@@ -170,9 +476,32 @@ class Simulator:
         #self.sim_settings = {'lmp_args': {}, **self.sim_settings}
         #self.sim_settings['lmp_args']['-in'] = self.lmp_script
         
-        exec_list = self.Device.get_exec_list(kwargs['mpi_args'] , kwargs['lmp_exec'], kwargs['lmp_args'], self.var)
-        self.jobscript_string = self.Device.gen_jobscript_string(exec_list, kwargs['slurm_args'])
-     
+        exec_list = Device.get_exec_list(kwargs['mpi_args'] , kwargs['lmp_exec'], kwargs['lmp_args'], self.var)
+        # generated when jobscript_string is first read
+        self._jobscript_parts = []
+        self._jobscript_args = (exec_list, kwargs['slurm_args'])
+
+    @property
+    def jobscript_string(self):
+        """Jobscript stored in the simulator, None if not generated.
+        A pre-generated jobscript is generated, and parts added by
+        add_to_jobscript are joined, on first access
+
+        :rtype: str
+        """
+        if self._jobscript_parts is None:
+            return None
+        if self._jobscript_args is not None:
+            self._jobscript_parts.insert(0, Device.gen_jobscript_string(*self._jobscript_args))
+            self._jobscript_args = None
+        if len(self._jobscript_parts) > 1:
+            self._jobscript_parts = ["".join(self._jobscript_parts)]
+        return self._jobscript_parts[0]
+
+    @jobscript_string.setter
+    def jobscript_string(self, string):
+        self._jobscript_parts = None if string is None else [string]
+        self._jobscript_args = None
    
     def add_to_jobscript(self, string, linebreak = True):
         """ Add a string to already exisitng self.jobscript_string.
@@ -182,10 +511,11 @@ class Simulator:
         :param linebreak: whether or not to add linebreak after string, 'True' by default. 
         :type linebreak: bool
         """ 
-        assert(isinstance(self.jobscript_string, str)), "Cannot add to jobscript when not initialized"
-        self.jobscript_string += string
+        assert(self._jobscript_parts is not None), "Cannot add to jobscript when not initialized"
+        # parts are joined once when the jobscript is read, not on every add
+        self._jobscript_parts.append(string)
         if linebreak: 
-            self.jobscript_string += "\n"
+            self._jobscript_parts.append("\n")
       
 
     def run_custom(self, stdout=subprocess.DEVNULL,
@@ -202,10 +532,7 @@ class Simulator:
         :rtype: int
         """
         warnings.warn("'run_custom' is deprecated from version 1.1.0, use 'run' instead", DeprecationWarning)
-        computer = self.Custom(**kwargs)
-        main_path = os.getcwd()
-        if self.wd is not None:
-            os.chdir(self.wd)
-        job_id = computer(self.lmp_script, self.var, stdout, stderr)
-        os.chdir(main_path)
+        from .computer import Custom    # deprecated module, only imported when used
+        computer = Custom(**kwargs)
+        job_id = computer(self.lmp_script, self.var, stdout, stderr, cwd=self.wd)
         return job_id
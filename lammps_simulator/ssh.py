@@ -0,0 +1,109 @@
+import os
+import socket
+import subprocess
+from collections import namedtuple
+from functools import lru_cache
+
+
+CONTROL_DIR = os.path.expanduser("~/.ssh/cm")
+CONTROL_PATH = os.path.join(CONTROL_DIR, "%r@%h:%p")
+CONTROL_PERSIST = 60
+
+_masters = set()
+
+# hosts that are this machine, where ssh and rsync are not needed
+LOCAL_HOSTS = frozenset(["localhost", "127.0.0.1", socket.gethostname()])
+
+SshTarget = namedtuple("SshTarget", ["host", "wd"])
+
+
+@lru_cache(maxsize=None)
+def parse_target(directory):
+    """Split directory on the form {host}:{path} into host and path. The
+    host is None for local directories, including directories on this
+    machine given as localhost:{path} or {hostname}:{path}. A ~ in the
+    path of such directories is expanded, like the remote shell would do
+
+    :param directory: directory, possibly on a remote host
+    :type directory: str
+    :returns: host and path of directory
+    :rtype: SshTarget
+    """
+    host, sep, wd = directory.partition(":")
+    if not sep:
+        return SshTarget(None, directory)
+    if host in LOCAL_HOSTS:
+        return SshTarget(None, os.path.expanduser(wd))
+    return SshTarget(host, wd)
+
+
+def ssh_options():
+    """Options making ssh reuse a multiplexed master connection per host
+
+    :returns: ssh command line options
+    :rtype: list of str
+    """
+    return ["-o", "ControlMaster=auto",
+            "-o", f"ControlPath={CONTROL_PATH}",
+            "-o", f"ControlPersist={CONTROL_PERSIST}"]
+
+
+def ssh_command(host, *command):
+    """Make ssh command list running command on host over the master
+    connection:
+
+        list = ['ssh', {options}, {host}, {command}]
+
+    :param host: remote host
+    :type host: str
+    :param command: command to be executed on host
+    :type command: tuple of str
+    :returns: list with ssh executables
+    :rtype: list of str
+    """
+    return ["ssh", *ssh_options(), host, *command]
+
+
+def rsync_command(*args):
+    """Make rsync command list where the ssh transport goes through the
+    master connection:
+
+        list = ['rsync', '-e', 'ssh {options}', {args}]
+
+    :param args: rsync arguments, like source and destination
+    :type args: tuple of str
+    :returns: list with rsync executables
+    :rtype: list of str
+    """
+    return ["rsync", "-e", " ".join(["ssh", *ssh_options()]), *args]
+
+
+def start_master(host):
+    """Start a persistent master connection to host in the background,
+    which subsequent ssh and rsync calls are multiplexed over. The master
+    is only started once per host. It is not closed at exit, as remote
+    runs may still use it, but exits by itself when it has been unused
+    for CONTROL_PERSIST seconds
+
+    :param host: remote host
+    :type host: str
+    """
+    if host in _masters:
+        return
+    os.makedirs(CONTROL_DIR, mode=0o700, exist_ok=True)
+    subprocess.run(["ssh", "-f", "-N", *ssh_options(), host],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _masters.add(host)
+
+
+def stop_master(host):
+    """Stop master connection to host from accepting new sessions. Running
+    sessions, like remote direct runs, are kept, and the master exits when
+    they have finished
+
+    :param host: remote host
+    :type host: str
+    """
+    subprocess.run(["ssh", *ssh_options(), "-O", "stop", host],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _masters.discard(host)